@@ -0,0 +1,118 @@
+"""
+Regression tests for mapping batched transcriptions back to their requests.
+
+batched_model.transcribe is replaced by a stub that cuts the audio with
+faster-whisper's own collect_chunks and restore_speech_timestamps, then
+"decodes" each chunk to the labels of the clips whose samples it contains.
+Every clip is filled with its own constant, so a request that receives
+another request's label means windows were merged or mis-attributed.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from faster_whisper.transcribe import Segment, restore_speech_timestamps
+from faster_whisper.vad import collect_chunks
+
+import main
+
+SAMPLE_RATE = main.SAMPLE_RATE
+
+
+def _label(value: float) -> str:
+    return f"<{value:g}>"
+
+
+def _fake_transcribe(audio, clip_timestamps, **kwargs):
+    """Mimic BatchedInferencePipeline.transcribe (faster-whisper 1.2, no timestamps)."""
+    clip_samples = [
+        {k: int(v * SAMPLE_RATE) for k, v in clip.items()} for clip in clip_timestamps
+    ]
+    audio_chunks, chunks_metadata = collect_chunks(
+        audio, clip_samples, max_duration=main.CHUNK_LENGTH_S
+    )
+
+    segments = []
+    for index, (chunk, metadata) in enumerate(zip(audio_chunks, chunks_metadata)):
+        values = np.unique(chunk[chunk != 0])
+        # Without timestamp tokens each chunk is one segment spanning the whole chunk
+        segments.append(Segment(
+            id=index + 1,
+            seek=0,
+            start=round(metadata["offset"], 3),
+            end=round(metadata["offset"] + metadata["duration"], 3),
+            text="".join(_label(value) for value in values),
+            tokens=[],
+            avg_logprob=0.0,
+            compression_ratio=0.0,
+            no_speech_prob=0.0,
+            words=None,
+            temperature=0.0,
+        ))
+
+    return restore_speech_timestamps(segments, clip_samples, SAMPLE_RATE), None
+
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch):
+    monkeypatch.setattr(main, "batched_model", SimpleNamespace(transcribe=_fake_transcribe))
+
+
+def _clips(durations_s: list) -> list:
+    """One clip per duration, each filled with its own value."""
+    return [
+        np.full(int(duration * SAMPLE_RATE), (index + 1) / 100, dtype=np.float32)
+        for index, duration in enumerate(durations_s)
+    ]
+
+
+def _expected(clips: list) -> list:
+    """Each clip's label once per 30s window it spans."""
+    window = main.CHUNK_LENGTH_S * SAMPLE_RATE
+    return [
+        _label(clip[0]) * -(-len(clip) // window) if len(clip) else ""
+        for clip in clips
+    ]
+
+
+@pytest.mark.parametrize("durations_s", [
+    [3, 3, 3],
+    [12, 15],
+    [5, 0, 65, 2, 31],
+    [30],
+    [30, 3, 30],
+])
+def test_each_request_gets_only_its_own_text(durations_s):
+    clips = _clips(durations_s)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        items = [(clip, loop.create_future()) for clip in clips]
+        await main._run_batch(items, asyncio.Semaphore(0))
+        return [future.result() for _, future in items]
+
+    assert asyncio.run(run()) == _expected(clips)
+
+
+def test_every_window_yields_one_segment():
+    clips = _clips([3, 3, 30])
+
+    _, window_segments = main._transcribe_windows(clips)
+
+    assert window_segments == [1, 1, 1]
+
+
+def test_concurrent_requests_through_the_batch_worker(monkeypatch):
+    clips = _clips([3, 12, 30, 45, 3])
+
+    async def run():
+        monkeypatch.setattr(main, "transcription_queue", asyncio.Queue())
+        monkeypatch.setattr(main, "batch_worker_task", asyncio.create_task(main.batch_worker()))
+        try:
+            return await asyncio.gather(*(main.transcribe_audio(clip) for clip in clips))
+        finally:
+            main.batch_worker_task.cancel()
+
+    assert asyncio.run(run()) == _expected(clips)
@@ -3,14 +3,20 @@ Voice Recording and Speech-to-Text using Whisper Large V3 Singlish Model
 This script records audio from the microphone and transcribes it in real-time.
 """
 
-import torch
-from transformers import AutoProcessor, AutoModelForSpeechSeq2Seq
+import ctranslate2
+from faster_whisper import WhisperModel
 import numpy as np
 import wave
 import io
 import argparse
 import sys
 
+from whisper_model import (
+    get_shared_model,
+    max_new_tokens_for,
+    DECODE_OPTIONS,
+)
+
 # Try to import pyaudio for microphone recording
 try:
     import pyaudio
@@ -32,35 +38,27 @@ class VoiceRecorder:
     
     SAMPLE_RATE = 16000  # Whisper expects 16kHz audio
     CHANNELS = 1
-    CHUNK_SIZE = 1024
+    CHUNK_SIZE = 4096
     
-    def __init__(self, device: str = None):
+    def __init__(self, device: str = None, model: WhisperModel = None):
         """
         Initialize the voice recorder with Whisper model.
         
         Args:
             device: Device to load model on ('cuda', 'cpu', or None for auto-detect)
+            model: Already loaded model to use instead of the shared one
         """
         if device is None:
-            device = "cuda" if torch.cuda.is_available() else "cpu"
+            device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
         
         self.device = device
-        self.processor = None
         self.model = None
-        self._load_model()
+        self._scratch = None  # Reused by _mean_abs between recordings
+        self._load_model(model)
     
-    def _load_model(self):
-        """Load the Whisper Singlish model and processor."""
-        print(f"Loading Whisper model on {self.device}...")
-        
-        self.processor = AutoProcessor.from_pretrained("mjwong/whisper-large-v3-singlish")
-        self.model = AutoModelForSpeechSeq2Seq.from_pretrained(
-            "mjwong/whisper-large-v3-singlish",
-            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-            low_cpu_mem_usage=True,
-        )
-        self.model.to(self.device)
-        print("Model loaded successfully!")
+    def _load_model(self, model: WhisperModel = None):
+        """Use the injected model, or the process-wide shared Whisper Singlish model."""
+        self.model = model if model is not None else get_shared_model(self.device)
     
     def record_audio_pyaudio(self, duration: float = 5.0) -> np.ndarray:
         """
@@ -87,12 +85,14 @@ class VoiceRecorder:
             frames_per_buffer=self.CHUNK_SIZE
         )
         
-        frames = []
-        num_chunks = int(self.SAMPLE_RATE / self.CHUNK_SIZE * duration)
+        # Chunks are copied straight into one pre-allocated buffer
+        total_samples = int(self.SAMPLE_RATE * duration)
+        audio_data = np.empty(total_samples, dtype=np.float32)
         
-        for _ in range(num_chunks):
-            data = stream.read(self.CHUNK_SIZE)
-            frames.append(np.frombuffer(data, dtype=np.float32))
+        for offset in range(0, total_samples, self.CHUNK_SIZE):
+            num_samples = min(self.CHUNK_SIZE, total_samples - offset)
+            data = stream.read(num_samples, exception_on_overflow=False)
+            audio_data[offset:offset + num_samples] = np.frombuffer(data, dtype=np.float32)
         
         stream.stop_stream()
         stream.close()
@@ -100,7 +100,6 @@ class VoiceRecorder:
         
         print("✅ Recording complete!")
         
-        audio_data = np.concatenate(frames)
         return audio_data
     
     def record_audio_sounddevice(self, duration: float = 5.0) -> np.ndarray:
@@ -118,17 +117,18 @@ class VoiceRecorder:
         
         print(f"\n🎤 Recording for {duration} seconds... Speak now!")
         
-        audio_data = sd.rec(
-            int(duration * self.SAMPLE_RATE),
+        # sounddevice records straight into this buffer
+        audio_data = np.empty((int(duration * self.SAMPLE_RATE), self.CHANNELS), dtype=np.float32)
+        sd.rec(
             samplerate=self.SAMPLE_RATE,
-            channels=self.CHANNELS,
-            dtype=np.float32
+            out=audio_data,
         )
         sd.wait()  # Wait until recording is finished
         
         print("✅ Recording complete!")
         
-        return audio_data.flatten()
+        # (N, 1) -> (N,) is a view, not a copy
+        return audio_data.reshape(-1)
     
     def record_audio(self, duration: float = 5.0) -> np.ndarray:
         """
@@ -162,31 +162,32 @@ class VoiceRecorder:
         """
         print("🔄 Transcribing...")
         
-        # Process the audio
-        inputs = self.processor(
+        # Generate transcription (log-mel features are computed by faster-whisper)
+        segments, _ = self.model.transcribe(
             audio,
-            sampling_rate=self.SAMPLE_RATE,
-            return_tensors="pt"
+            language="en",
+            task="transcribe",
+            vad_filter=False,
+            max_new_tokens=max_new_tokens_for(len(audio) / self.SAMPLE_RATE),
+            **DECODE_OPTIONS,
         )
         
-        # Move inputs to the same device as the model
-        input_features = inputs.input_features.to(self.device)
-        if self.device == "cuda":
-            input_features = input_features.half()
+        # segments is a lazy generator; joining it runs the decoder
+        transcription = "".join(segment.text for segment in segments)
         
-        # Generate transcription
-        with torch.no_grad():
-            generated_ids = self.model.generate(
-                input_features,
-                max_new_tokens=444,
-                language="en",
-                task="transcribe",
-            )
+        return transcription
+    
+    def _mean_abs(self, audio: np.ndarray) -> float:
+        """
+        Mean absolute amplitude of the audio.
         
-        # Decode the generated tokens
-        transcription = self.processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+        |audio| is written into a scratch buffer kept across calls, so the
+        silence check doesn't allocate a new temporary for every recording.
+        """
+        if self._scratch is None or self._scratch.shape[0] < audio.shape[0]:
+            self._scratch = np.empty(audio.shape[0], dtype=np.float32)
         
-        return transcription
+        return float(np.abs(audio, out=self._scratch[:audio.shape[0]]).mean())
     
     def record_and_transcribe(self, duration: float = 5.0) -> str:
         """
@@ -220,7 +221,7 @@ class VoiceRecorder:
                 audio = self.record_audio(duration)
                 
                 # Check if audio has speech (not just silence)
-                if np.abs(audio).mean() > silence_threshold:
+                if self._mean_abs(audio) > silence_threshold:
                     text = self.transcribe(audio)
                     if text.strip():
                         print(f"\n📝 You said: {text}")
@@ -0,0 +1,136 @@
+"""
+Shared Whisper Large V3 Singlish model (CTranslate2) for the API and the voice recorder.
+Kept free of audio-device imports so the server can load it headless.
+"""
+
+from faster_whisper import WhisperModel
+import os
+import gc
+import shutil
+
+MODEL_ID = "mjwong/whisper-large-v3-singlish"
+CT2_MODEL_DIR = os.getenv(
+    "CT2_MODEL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "ct2-singlish"),
+)
+
+# Weight quantization: "int8" (default) or "none" for full fp16/fp32 weights
+QUANT_MODE = os.getenv("QUANT_MODE", "int8").lower()
+COMPUTE_TYPES = {
+    "none": {"cuda": "float16", "cpu": "float32"},
+    "int8": {"cuda": "int8_float16", "cpu": "int8"},
+}
+
+
+def get_compute_type(device: str) -> str:
+    """Map QUANT_MODE to a CTranslate2 compute type for the given device."""
+    if QUANT_MODE not in COMPUTE_TYPES:
+        raise ValueError(
+            f"Unsupported QUANT_MODE '{QUANT_MODE}'. "
+            f"Choose one of: {', '.join(COMPUTE_TYPES)}"
+        )
+    return COMPUTE_TYPES[QUANT_MODE][device]
+
+
+# Fused FlashAttention kernels (CUDA, Ampere or newer); needs a CTranslate2 build with FlashAttention
+FLASH_ATTENTION = os.getenv("FLASH_ATTENTION", "0") == "1"
+
+# Decoder token budget: Whisper's hard limit and roughly how many tokens a second of speech needs
+MAX_NEW_TOKENS = 444
+TOKENS_PER_SECOND = 12.5
+
+
+def max_new_tokens_for(duration_s: float) -> int:
+    """Cap the decoder steps for a window of audio (a window is at most 30s)."""
+    duration_s = min(duration_s, 30.0)
+    return min(MAX_NEW_TOKENS, max(32, int(duration_s * TOKENS_PER_SECOND) + 16))
+
+
+# Greedy single-pass decoding: no beam search, no temperature fallback re-decodes
+DECODE_OPTIONS = {
+    "beam_size": 1,
+    "temperature": 0.0,
+    "compression_ratio_threshold": None,
+    "log_prob_threshold": None,
+    "no_speech_threshold": None,
+    "no_repeat_ngram_size": 0,
+    # Windows decode independently (also keeps the prompt short enough for the token cap)
+    "condition_on_previous_text": False,
+}
+
+# Concurrent transcriptions for the API's model; each CTranslate2 worker runs on its own CUDA stream / CPU threads
+TRANSCRIBE_WORKERS = max(1, int(os.getenv("TRANSCRIBE_WORKERS", "2")))
+
+# Models loaded in this process, shared by every VoiceRecorder and the FastAPI app
+_SHARED_WHISPER = {}
+
+
+def convert_model(output_dir: str = CT2_MODEL_DIR):
+    """Convert the HuggingFace checkpoint to CTranslate2 format (once)."""
+    # model.bin is only there once a conversion has finished
+    if os.path.isfile(os.path.join(output_dir, "model.bin")):
+        return
+    
+    # The converter loads the checkpoint with torch/transformers; inference never needs them
+    from ctranslate2.converters import TransformersConverter
+    
+    print(f"Converting {MODEL_ID} to CTranslate2 format in {output_dir}...")
+    converter = TransformersConverter(
+        MODEL_ID,
+        # faster-whisper reads the tokenizer and the mel settings (128 bins for v3) from these
+        copy_files=["tokenizer.json", "preprocessor_config.json"],
+    )
+    # Convert next to the target and move it into place, so an interrupted
+    # run never leaves a half-written model behind under output_dir
+    partial_dir = output_dir + ".partial"
+    converter.convert(partial_dir, quantization="float16", force=True)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(partial_dir, output_dir)
+
+
+def get_shared_model(device: str, num_workers: int = 1) -> WhisperModel:
+    """
+    Return the Whisper model for a device, loading it on first use.
+    
+    Args:
+        device: Device to load model on ('cuda' or 'cpu')
+        num_workers: Transcriptions the model must be able to run concurrently
+        
+    Returns:
+        Shared faster-whisper model (a cached one is reused if it has enough workers)
+    """
+    compute_type = get_compute_type(device)
+    key = (CT2_MODEL_DIR, device, compute_type)
+    
+    cached = _SHARED_WHISPER.get(key)
+    if cached is not None and cached[0] >= num_workers:
+        return cached[1]
+    
+    convert_model()
+    print(f"Loading Whisper model on {device} ({compute_type}, {num_workers} worker(s))...")
+    # Only passed when requested: older CTranslate2 releases (e.g. 4.0.0) reject the option
+    model_kwargs = {}
+    if FLASH_ATTENTION and device == "cuda":
+        model_kwargs["flash_attention"] = True
+    
+    whisper_model = WhisperModel(
+        CT2_MODEL_DIR,
+        device=device,
+        compute_type=compute_type,
+        # CTranslate2 otherwise caps CPU inference at 4 intra-op threads; split cores between workers
+        cpu_threads=max(1, (os.cpu_count() or 1) // num_workers) if device == "cpu" else 0,
+        num_workers=num_workers,
+        **model_kwargs,
+    )
+    _SHARED_WHISPER[key] = (num_workers, whisper_model)
+    print("Model loaded successfully!")
+    
+    return whisper_model
+
+
+def release_shared_models():
+    """Unload all shared models and free their host/GPU memory."""
+    for _, whisper_model in _SHARED_WHISPER.values():
+        whisper_model.model.unload_model()
+    _SHARED_WHISPER.clear()
+    gc.collect()